@@ -1,10 +1,13 @@
 import argparse
-import json
+import orjson
 import re
 import os
 import csv
 import utils
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import Counter
+from operator import itemgetter
+import numpy as np
 from scipy import stats
 
 TARGETS = ["abac_type_directed", "eval_type_directed",
@@ -12,21 +15,73 @@ TARGETS = ["abac_type_directed", "eval_type_directed",
 GENERATORS = ["derived", "fail_fast", "fail_fix"]
 FUZZERS = ["random", "libfuzzer", "afl"]
 
+_FIRST_RE = re.compile(rb'#(\d+)')
+_VALID_RE = re.compile(rb'valid:\s*(\d+)')
+
 def get_exec_and_valid_from_valid_log(valid_log, time=3600):
-    with open(valid_log) as f:
-        lines = f.readlines()
+    # Only the last line matters, so read a small window from the end of the log,
+    # doubling it until the last line is known to be whole (a line break precedes it)
+    with open(valid_log, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        window = 4096
+        while True:
+            f.seek(max(0, size - window))
+            lines = [line for line in f.read().splitlines() if line.strip()]
+            if window >= size or len(lines) > 1:
+                break
+            window *= 2
     if not lines:
         return 0, 0
     line = lines[-1]
-    first_number = re.search(r'#(\d+)', line)
+    first_number = _FIRST_RE.search(line)
     assert first_number
 
     # Parse the number after 'valid:'
-    valid_number = re.search(r'valid:\s*(\d+)', line)
+    valid_number = _VALID_RE.search(line)
     return int(first_number.group(1)) / time, int(valid_number.group(1)) / time
 
+def get_stats_from_obs_log(obs_log, target, k=2):
+    df = utils.load_json_df(obs_log)
+    valid_df = df[df["status"] == "passed"]
+    total_count = len(valid_df)
+    # Fuzzer corpora repeat representations, so parse and analyze each distinct one
+    # once and weight its results by how often it occurs
+    rep_counts = valid_df["representation"].value_counts(sort=False)
+    unique_pct = len(rep_counts) / total_count * 100
+    parsed = list(map(orjson.loads, rep_counts.index.to_numpy()))
+    if "eval" in target:
+        get_expr = itemgetter("expression")
+        exprs_per_rep = [[get_expr(d)] for d in parsed]
+    else:
+        exprs_per_rep = [[e['body'] for e in d['policy']['conditions']] for d in parsed]
+    results_per_rep = [[utils.analyze_expr(e, k) for e in exprs] for exprs in exprs_per_rep]
+    total_size = 0
+    total_kpaths = 0
+    num_exprs = 0
+    category_totals = Counter()
+    for results, count in zip(results_per_rep, rep_counts.to_numpy().tolist()):
+        for result in results:
+            if result is None:
+                continue
+            size, category_map, kpaths = result
+            total_size += size * count
+            total_kpaths += kpaths * count
+            num_exprs += count
+            category_totals.update({cat: n * count for cat, n in category_map.items()})
+    if not num_exprs:
+        return None
+    # Normalize the summed category counts; this equals normalizing the per-expression means
+    category_freqs = np.array(list(category_totals.values()), dtype=np.float64)
+    category_freqs /= category_freqs.sum()
+    mean_est_size = total_size / num_exprs
+    entropy = stats.entropy(category_freqs)
+    mean_kpaths = total_kpaths / num_exprs
+    return unique_pct, mean_est_size, entropy, mean_kpaths
+
 def read_random_exec_data(data_dir, reps=1, output_file=None):
     rows = [["target", "generator", "fuzzer", "rep", "total execs/s", "valid execs/s", "valid_percent"]]
+    append = rows.append
     for target in TARGETS:
         for generator in GENERATORS:
             for r in range(1, reps + 1):
@@ -34,7 +89,7 @@ def read_random_exec_data(data_dir, reps=1, output_file=None):
                 total, valid = get_exec_and_valid_from_valid_log(log_path, 3600)
                 if total and valid:
                     valid_percent = valid * 1.0 / total
-                    rows.append([target, generator, "random", r, total, valid, valid_percent])
+                    append([target, generator, "random", r, total, valid, valid_percent])
     if output_file:
         with open(output_file, 'w', newline='') as f:
             writer = csv.writer(f)
@@ -42,45 +97,17 @@ def read_random_exec_data(data_dir, reps=1, output_file=None):
 
 def read_random_obs_data(data_dir, reps=1, output_file=None):
     rows = [["target", "generator", "fuzzer", "rep", "unique_pct", "mean_est_size", "entropy", "mean_kpaths"]]
+    append = rows.append
     for target in TARGETS:
         for generator in GENERATORS:
             for r in range(1, reps + 1):
                 log_path = os.path.join(data_dir, target, "random", generator, f"rep_{r}", "obs.jsonl")
                 if not os.path.exists(log_path):
                     continue
-                df = utils.load_json_df(log_path)
-                valid_df = df[df["status"] == "passed"]
-                total_count = len(valid_df)
-                unique_pct = valid_df["representation"].nunique() / total_count * 100
-                if "eval" in target:
-                    exprs = valid_df["representation"].apply(lambda x: json.loads(x)["expression"])
-                else:
-                    exprs = []
-                    # Loop through all values of valid_df["representation"]
-                    for v in valid_df["representation"]:
-                        # Parse the JSON string into a dictionary
-                        d = json.loads(v)["policy"]
-                        # Get the value of the key "expression" in the dictionary
-                        exprs += [e['body'] for e in d['conditions']]
-                try:
-                    expr_est_sizes = [utils.count_size(e) for e in exprs]
-                    category_maps = [utils.get_category_map(e) for e in exprs]
-                except:
+                obs_stats = get_stats_from_obs_log(log_path, target)
+                if obs_stats is None:
                     continue
-                # Step 2: Create a new DataFrame from the Series
-                category_freqs_df = pd.DataFrame(category_maps)
-                category_freqs_df = category_freqs_df.fillna(0)
-
-                # Step 3: Calculate the mean of each column (category) across all rows
-                category_mean_freqs = category_freqs_df.mean(axis=0)
-
-                # Step 4: Normalize frequencies
-                category_mean_freqs = category_mean_freqs / category_mean_freqs.sum()
-                mean_est_size = sum(expr_est_sizes) / len(expr_est_sizes)
-                entropy = stats.entropy(category_mean_freqs.values)
-                k_paths = [utils.num_kpaths(e) for e in exprs]
-                mean_kpaths = sum(k_paths) / len(k_paths)
-                rows.append([target, generator, "random", r, unique_pct, mean_est_size, entropy, mean_kpaths])
+                append([target, generator, "random", r, *obs_stats])
     if output_file:
         with open(output_file, 'w', newline='') as f:
             writer = csv.writer(f)
@@ -88,6 +115,8 @@ def read_random_obs_data(data_dir, reps=1, output_file=None):
 
 def read_coverage_exec_data(data_dir, reps=5, output_file=None):
     rows = [["target", "generator", "fuzzer", "rep", "checkpoint", "total execs/s", "valid execs/s", "valid_percent"]]
+    append = rows.append
+    jobs = []
     for target in TARGETS:
         for generator in GENERATORS:
             for r in range(1, reps + 1):
@@ -99,17 +128,29 @@ def read_coverage_exec_data(data_dir, reps=5, output_file=None):
                     if not os.path.exists(log_path):
                         print("MISSING!!")
                         continue
-                    total, valid = get_exec_and_valid_from_valid_log(log_path, 300)
-                    if total and valid:
-                        valid_percent = valid * 1.0 / total
-                        rows.append([target, generator, "coverage", r, checkpoint, total, valid, valid_percent])
+                    jobs.append((log_path, target, generator, r, checkpoint))
+    # The logs are small and reading them is I/O bound, so overlap the reads in threads
+    with ThreadPoolExecutor() as executor:
+        results = executor.map(lambda job: get_exec_and_valid_from_valid_log(job[0], 300), jobs)
+        for (log_path, target, generator, r, checkpoint), (total, valid) in zip(jobs, results):
+            if total and valid:
+                valid_percent = valid * 1.0 / total
+                append([target, generator, "coverage", r, checkpoint, total, valid, valid_percent])
     if output_file:
         with open(output_file, 'w', newline='') as f:
             writer = csv.writer(f)
             writer.writerows(rows)
 
+def process_coverage_obs_log(log_path, target, generator, r, checkpoint):
+    obs_stats = get_stats_from_obs_log(log_path, target)
+    if obs_stats is None:
+        return None
+    return [target, generator, "random", r, checkpoint, *obs_stats]
+
 def read_coverage_obs_data(data_dir, reps=1, output_file=None):
     rows = [["target", "generator", "fuzzer", "rep", "checkpoint", "unique_pct", "mean_est_size", "entropy", "mean_kpaths"]]
+    append = rows.append
+    jobs = []
     for target in TARGETS:
         for generator in GENERATORS:
             for r in range(1, reps + 1):
@@ -120,61 +161,12 @@ def read_coverage_obs_data(data_dir, reps=1, output_file=None):
                     if not os.path.exists(log_path):
                         print("MISSING!!")
                         continue
-                    df = utils.load_json_df(log_path)
-                    valid_df = df[df["status"] == "passed"]
-                    total_count = len(valid_df)
-                    unique_pct = valid_df["representation"].nunique() / total_count * 100
-                    if "eval" in target:
-                        exprs = valid_df["representation"].apply(lambda x: json.loads(x)["expression"])
-                    else:
-                        exprs = []
-                        # Loop through all values of valid_df["representation"]
-                        for v in valid_df["representation"]:
-                            # Parse the JSON string into a dictionary
-                            d = json.loads(v)["policy"]
-                            # Get the value of the key "expression" in the dictionary
-                            exprs += [e['body'] for e in d['conditions']]
-                    try:
-                        expr_est_sizes = [utils.count_size(e) for e in exprs]
-                        category_maps = [utils.get_category_map(e) for e in exprs]
-                    except:
-                        continue
-                    # Step 2: Create a new DataFrame from the Series
-                    category_freqs_df = pd.DataFrame(category_maps)
-                    category_freqs_df = category_freqs_df.fillna(0)
-
-                    # Step 3: Calculate the mean of each column (category) across all rows
-                    category_mean_freqs = category_freqs_df.mean(axis=0)
-
-                    # Step 4: Normalize frequencies
-                    category_mean_freqs = category_mean_freqs / category_mean_freqs.sum()
-                    mean_est_size = sum(expr_est_sizes) / len(expr_est_sizes)
-                    entropy = stats.entropy(category_mean_freqs.values)
-                    k_paths = [utils.num_kpaths(e) for e in exprs]
-                    mean_kpaths = sum(k_paths) / len(k_paths)
-                    rows.append([target, generator, "random", r, checkpoint, unique_pct, mean_est_size, entropy, mean_kpaths])
-        if output_file:
-            with open(output_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerows(rows)
-
-    def read_coverage_exec_data(data_dir, reps=5, output_file=None):
-        rows = [["target", "generator", "fuzzer", "rep", "checkpoint", "total execs/s", "valid execs/s", "valid_percent"]]
-        for target in TARGETS:
-            for generator in GENERATORS:
-                for r in range(1, reps + 1):
-                    for checkpoint in range(0, 13):
-                        log_path = os.path.join(data_dir, target, "libfuzzer",
-                                                generator, f"rep_{r}", "checkpoint_results",
-                                                f"hour_{checkpoint}", "valid.log")
-                        print(log_path)
-                        if not os.path.exists(log_path):
-                            print("MISSING!!")
-                            continue
-                        total, valid = get_exec_and_valid_from_valid_log(log_path, 300)
-                        if total and valid:
-                            valid_percent = valid * 1.0 / total
-                            rows.append([target, generator, "coverage", r, checkpoint, total, valid, valid_percent])
+                    jobs.append((log_path, target, generator, r, checkpoint))
+    # Each checkpoint log is independent, so analyze them all across worker processes
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for row in executor.map(process_coverage_obs_log, *zip(*jobs), chunksize=8):
+            if row is not None:
+                append(row)
     if output_file:
         with open(output_file, 'w', newline='') as f:
             writer = csv.writer(f)
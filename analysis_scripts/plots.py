@@ -3,7 +3,7 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import utils
 from scipy import stats
-import json
+import orjson
 
 def plot_uniqueness(df, columns, generators, savefile=None, title='Uniqueness Plots'):
     # Create a figure and axis object
@@ -21,8 +21,9 @@ def plot_uniqueness(df, columns, generators, savefile=None, title='Uniqueness Pl
         df = df[df["generator"] == generator]
         unique_percentages = []
         for col in columns:
-            if df[col].apply(lambda x: isinstance(x, dict) or isinstance(x, list)).any():
-                df[col] = df[col].apply(lambda x: str(x))
+            # Only object columns can hold dicts/lists; stringify them so they are hashable
+            if df[col].dtype == object and df[col].map(type).isin([dict, list]).any():
+                df[col] = df[col].map(str)
             # Count the unique values
             unique_count = df[col].nunique()
             # Count the total values
@@ -133,7 +134,7 @@ def plot_validity_over_time(df, target, column='Validity', feature="Unique Expre
 
 def plot_est_node_dist(df, generator='Derived', savefig=None):
     # Step 1: Apply the get_category_map function
-    category_maps = df[df['generator'] == generator]['expression'].apply(lambda x: utils.get_category_map(json.loads(x)))
+    category_maps = df[df['generator'] == generator]['expression'].apply(lambda x: utils.get_category_map(orjson.loads(x)))
 
     # Step 2: Create a new DataFrame from the Series
     category_freqs_df = pd.DataFrame(category_maps.tolist())
@@ -1,7 +1,10 @@
 import numbers
+from collections import Counter
+import numpy as np
+import orjson
 import pandas as pd
+from numba import njit
 
-import networkx as nx
 grammar = {
   "grammar": {
     "expression": [
@@ -43,6 +46,7 @@ grammar = {
 unary_subexprs = set(["!", "neg"])
 binary_subexprs = set(["==", "!=", "in", "<", "<=", ">",">=", "&&", "||", "+", "-", "*", "contains", "containsAll", "containsAny"])
 lhs_only_subexprs = set(["like", ".", "has", "is"])
+leaf_subexprs = set(["Value", "Var", "Slot", "Unknown"])
 decimal_ops = set([
     "greaterThanOrEqual",
     "greaterThan",
@@ -61,7 +65,28 @@ CATEGORIES = {
 }
 
 def get_descriptor_key(v):
-    return list(v.keys())[0]
+    return next(iter(v))
+
+_OPERAND_KEYS = {"if-then-else": ("if", "then", "else")}
+_OPERAND_KEYS.update({d: ("arg",) for d in unary_subexprs})
+_OPERAND_KEYS.update({d: ("left", "right") for d in binary_subexprs})
+_OPERAND_KEYS.update({d: ("left",) for d in lhs_only_subexprs})
+
+def is_expr(v):
+    # Every EST node is a dict keyed by its descriptor, holding the operands its
+    # child extractor reads: named keys, a Record dict, or a Set/extension-call list
+    if not isinstance(v, dict) or not v:
+        return False
+    key = get_descriptor_key(v)
+    if key in leaf_subexprs:
+        return True
+    obj = v[key]
+    if key == "Record":
+        return isinstance(obj, dict)
+    operand_keys = _OPERAND_KEYS.get(key)
+    if operand_keys is None:
+        return isinstance(obj, list)
+    return isinstance(obj, dict) and all(k in obj for k in operand_keys)
 
 
 def extract_value_kind(v):
@@ -91,93 +116,25 @@ def get_category(kind):
 
 def get_category_map(v):
     all_subexprs = subexprs(v)
-    cats = [get_category(get_expr_kind(e)) for e in all_subexprs]
-    return {i:cats.count(i) for i in set(cats)}
+    return Counter(get_category(get_expr_kind(e)) for e in all_subexprs)
 
 
 def subexprs(v):
-    descriptor = get_descriptor_key(v)
-    subexpr = None
-    if descriptor == "Value" or descriptor == "Var" or descriptor == "Slot" or descriptor == "Unknown":
-        subexpr = []
-    elif descriptor in unary_subexprs:
-        subexpr = unary_subexpr(v)
-    elif descriptor in binary_subexprs:
-        subexpr = binary_subexpr(v)    
-    elif descriptor in lhs_only_subexprs:
-        subexpr = lhs_only_subexpr(v)
-    elif descriptor == "if-then-else":
-        subexpr = ite_subexpr(v)
-    elif descriptor == "Set":
-        subexpr = set_subexpr(v)
-    elif descriptor == "Record":
-        subexpr = record_subexpr(v)
-    else:
-        subexpr = extension_call_subexpr(v)
-    subexpr.append(v)
-    return subexpr
-
-def unary_subexpr(v):
-    key = get_descriptor_key(v)
-    obj = v[key]["arg"]
-    return subexprs(obj)
-
-def binary_subexpr(v):
-    obj = v[get_descriptor_key(v)]
-    left = subexprs(obj["left"])
-    right = subexprs(obj["right"])
-    left.extend(right)
-    return left
-
-def lhs_only_subexpr(v):
-    obj = v[get_descriptor_key(v)]
-    return subexprs(obj["left"])
-
-def ite_subexpr(v):
-    obj = v[get_descriptor_key(v)]
-    condition = subexprs(obj["if"])
-    consequent = subexprs(obj["then"])
-    alternative = subexprs(obj["else"])
-    condition.extend(consequent)
-    condition.extend(alternative)
-    return condition
-
-def set_subexpr(v):
-    arr = v["Set"]
-    iter_result = [subexprs(item) for item in arr if item]
-    return [item for sublist in iter_result for item in sublist]
-
-def record_subexpr(v):
-    internal = v["Record"]
-    t = [subexprs(obj) for obj in internal.values() if obj]
-    return [item for sublist in t for item in sublist]
-
-def extension_call_subexpr(v):
-    args = v[get_descriptor_key(v)]
-    iter_result = [subexprs(item) for item in args if item]
-    return [item for sublist in iter_result for item in sublist]
+    # Iterative DFS so deeply nested expressions don't hit the recursion limit
+    all_subexprs = []
+    stack = [v]
+    while stack:
+        e = stack.pop()
+        all_subexprs.append(e)
+        stack.extend(children(e))
+    return all_subexprs
 
 
 def children(v):
-    descriptor = get_descriptor_key(v)
-    children = None
-    if descriptor == "Value" or descriptor == "Var" or descriptor == "Slot" or descriptor == "Unknown":
-        children = []
-    elif descriptor in unary_subexprs:
-        children = unary_child(v)
-    elif descriptor in binary_subexprs:
-        children = binary_child(v)    
-    elif descriptor in lhs_only_subexprs:
-        children = lhs_only_child(v)
-    elif descriptor == "if-then-else":
-        children = ite_child(v)
-    elif descriptor == "Set":
-        children = set_child(v)
-    elif descriptor == "Record":
-        children = record_child(v)
-    else:
-        children = extension_call_child(v)
-    return children
+    return _CHILD_EXTRACTORS.get(get_descriptor_key(v), extension_call_child)(v)
+
+def leaf_child(v):
+    return []
 
 def unary_child(v):
     key = get_descriptor_key(v)
@@ -202,35 +159,21 @@ def set_child(v):
 
 def record_child(v):
     internal = v["Record"]
-    return list(internal.values())
+    return [obj for obj in internal.values() if obj]
 
 def extension_call_child(v):
     args = v[get_descriptor_key(v)]
     return [item for item in args if item]
 
-def construct_graph(G, expr):
-    key = get_descriptor_key(expr)
-    G.add_node(key)
-    for child in children(expr):
-        construct_graph(G, child)
-        G.add_edge(key, get_descriptor_key(child))
-
-def est_to_graph(est):
-    G = nx.DiGraph()
-    construct_graph(G, est)
-    return G    
-
-def find_paths(G, node, k):
-    if k == 0:
-        return [[node]]
-    paths = [[node] + path for neighbor in G.neighbors(node) for path in find_paths(G, neighbor, k - 1) if node not in path]
-    return paths
-
-def find_all_paths(G, node, k):
-    allpaths = []
-    for node in G:
-        allpaths.extend(find_paths(G, node, k))
-    return allpaths
+_CHILD_EXTRACTORS = {
+    "if-then-else": ite_child,
+    "Set": set_child,
+    "Record": record_child,
+}
+_CHILD_EXTRACTORS.update({d: leaf_child for d in leaf_subexprs})
+_CHILD_EXTRACTORS.update({d: unary_child for d in unary_subexprs})
+_CHILD_EXTRACTORS.update({d: binary_child for d in binary_subexprs})
+_CHILD_EXTRACTORS.update({d: lhs_only_child for d in lhs_only_subexprs})
 
 #[metric("Count", "Count of sub exprs", "Count", "# of expressions")]
 
@@ -245,30 +188,114 @@ def expr_kinds(est):
 
 #TODO: k-path coverage
 def num_kpaths(est, k=2):
-    G = est_to_graph(est)
-    return len(find_all_paths(G, est, k))
-
-def load_json_df(df_file):
-    df = pd.read_json(open(df_file, "r"), lines=True)
+    result = analyze_expr(est, k)
+    if result is None:
+        raise ValueError("malformed EST expression")
+    return result[2]
+
+def edges_to_csr(num_nodes, edges):
+    edges = sorted(edges)
+    srcs = np.array([src for src, _ in edges], dtype=np.int64)
+    indices = np.array([dst for _, dst in edges], dtype=np.int64)
+    indptr = np.searchsorted(srcs, np.arange(num_nodes + 1))
+    return indptr, indices
+
+@njit(cache=True)
+def count_kpaths(indptr, indices, k):
+    # Counts simple paths with k edges, starting from every node
+    num_nodes = indptr.shape[0] - 1
+    path = np.empty(k + 1, dtype=np.int64)
+    pos = np.empty(k + 1, dtype=np.int64)
+    count = 0
+    for start in range(num_nodes):
+        depth = 0
+        path[0] = start
+        pos[0] = indptr[start]
+        while depth >= 0:
+            if depth == k:
+                count += 1
+                depth -= 1
+                continue
+            if pos[depth] == indptr[path[depth] + 1]:
+                depth -= 1
+                continue
+            neighbor = indices[pos[depth]]
+            pos[depth] += 1
+            on_path = False
+            for i in range(depth + 1):
+                if path[i] == neighbor:
+                    on_path = True
+                    break
+            if not on_path:
+                depth += 1
+                path[depth] = neighbor
+                pos[depth] = indptr[neighbor]
+    return count
+
+def analyze_expr(est, k=2):
+    # Single walk over the EST yielding its size, category counts and k-path count.
+    # k-paths are simple paths in the graph whose nodes are descriptor kinds and whose
+    # edges link a parent's kind to each child's kind, stored as CSR adjacency
+    # Returns None if any node is malformed (see is_expr), so callers can skip the expression
+    if not is_expr(est):
+        return None
+    size = 0
+    cats = Counter()
+    node_ids = {}
+    edges = set()
+    stack = [est]
+    while stack:
+        e = stack.pop()
+        size += 1
+        cats[get_category(get_expr_kind(e))] += 1
+        src = node_ids.setdefault(get_descriptor_key(e), len(node_ids))
+        for child in children(e):
+            if not is_expr(child):
+                return None
+            edges.add((src, node_ids.setdefault(get_descriptor_key(child), len(node_ids))))
+            stack.append(child)
+    indptr, indices = edges_to_csr(len(node_ids), edges)
+    return size, cats, count_kpaths(indptr, indices, k)
+
+def load_json_df(df_file, columns=("status", "representation")):
+    # Stream the JSONL file and keep only the requested fields of each record
+    _loads = orjson.loads
+    values = {col: [] for col in columns}
+    with open(df_file, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            d = _loads(line)
+            for col in columns:
+                values[col].append(d.get(col))
+    df = pd.DataFrame(values)
     return df
 
+def parse_representations(df):
+    _loads = orjson.loads
+    return [_loads(x) if x else {} for x in df["representation"].to_numpy()]
+
 def load_eval_df(df):
-    df["entities"] = df["representation"].apply(lambda x: json.loads(x)["entities"] if x else "")
-    df["request"] = df["representation"].apply(lambda x: json.loads(x)["request"] if x else "")
-    df["expression"] = df["representation"].apply(lambda x: json.loads(x)["expression"] if x else "")
+    parsed = parse_representations(df)
+    df["entities"] = [d.get("entities", "") for d in parsed]
+    df["request"] = [d.get("request", "") for d in parsed]
+    df["expression"] = [d.get("expression", "") for d in parsed]
     return df
 
 def load_policy_df(df):
-    df["policy"] = df["representation"].apply(lambda x: json.loads(x)["policy"] if x else "")
+    parsed = parse_representations(df)
+    df["policy"] = [d.get("policy", "") for d in parsed]
     return df
 
 def load_abac_df(df):
-    df["entities"] = df["representation"].apply(lambda x: json.loads(x)["entities"] if x else "")
-    df["requests"] = df["representation"].apply(lambda x: json.loads(x)["requests"] if x else "")
-    df["policy"] = df["representation"].apply(lambda x: json.loads(x)["policy"] if x else "")
+    parsed = parse_representations(df)
+    df["entities"] = [d.get("entities", "") for d in parsed]
+    df["requests"] = [d.get("requests", "") for d in parsed]
+    df["policy"] = [d.get("policy", "") for d in parsed]
     return df
 
 def load_validation_df(df):
-    df["schema"] = df["representation"].apply(lambda x: json.loads(x)["schema"] if x else "")
-    df["policy"] = df["representation"].apply(lambda x: json.loads(x)["policy"] if x else "")
-    return df
\ No newline at end of file
+    parsed = parse_representations(df)
+    df["schema"] = [d.get("schema", "") for d in parsed]
+    df["policy"] = [d.get("policy", "") for d in parsed]
+    return df